@@ -1,8 +1,17 @@
+import json
 import jwt
-import requests
+from jwt.algorithms import RSAAlgorithm
+import base64
+import hashlib
+import hmac
+import httpx
+import logging
 import os
-import sys
+import re
+import threading
+import time
 from typing import Optional, Dict
+from collections import OrderedDict
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -10,7 +19,39 @@ load_dotenv()
 KEYCLOAK_URL = os.getenv('KEYCLOAK_URL', 'https://wopr.systems/auth')
 KEYCLOAK_REALM = os.getenv('KEYCLOAK_REALM', 'master')
 
-print(f"[AUTH] Loaded config: URL={KEYCLOAK_URL}, REALM={KEYCLOAK_REALM}", file=sys.stderr)
+# Per-request traces are DEBUG so they cost one level check when disabled;
+# set AUTH_LOG_LEVEL=DEBUG to get the old verbose output back.
+logger = logging.getLogger(__name__)
+logger.setLevel(os.getenv("AUTH_LOG_LEVEL", "WARNING"))
+
+logger.info("Loaded config: URL=%s, REALM=%s", KEYCLOAK_URL, KEYCLOAK_REALM)
+
+# In-process JWKS cache so we don't hit Keycloak on every request.
+# keys_by_kid maps kid -> rsa key dict; refetch only on expiry or on a kid
+# miss (rate-limited, so a flood of bad tokens can't hammer Keycloak).
+JWKS_TTL_SECONDS = 600
+JWKS_MISS_REFRESH_SECONDS = 30
+_JWKS_CACHE = {"keys_by_kid": {}, "pubkeys_by_kid": {}, "expires_at": 0.0, "last_miss_refresh": 0.0}
+_JWKS_LOCK = threading.Lock()
+
+# Verified-token cache: sha256(token) -> (exp, payload). The same bearer
+# token hits many endpoints per second, and each full RS256 verify costs
+# ~0.5-1ms of public-key math; entries live until the token's own exp.
+TOKEN_CACHE_MAX = 4096
+_TOKEN_CACHE = OrderedDict()
+_TOKEN_CACHE_LOCK = threading.Lock()
+
+# Shared pooled client so JWKS refetches reuse the TCP+TLS connection to
+# Keycloak instead of handshaking every time (rest of the backend uses httpx).
+_HTTP = httpx.Client(timeout=5.0, limits=httpx.Limits(max_keepalive_connections=4))
+
+def _jwks_ttl_from_response(response) -> float:
+    # Honor Cache-Control: max-age if Keycloak sends one
+    cache_control = response.headers.get("Cache-Control", "")
+    m = re.search(r'max-age=(\d+)', cache_control)
+    if m:
+        return float(m.group(1))
+    return float(JWKS_TTL_SECONDS)
 
 class User:
     def __init__(self, user_id: str, username: str, email: str, is_admin: bool = False):
@@ -19,58 +60,108 @@ class User:
         self.email = email
         self.is_admin = is_admin
 
-def get_keycloak_public_key():
-    url = f"{KEYCLOAK_URL}/realms/{KEYCLOAK_REALM}/protocol/openid-connect/certs"
-    print(f"[AUTH] Fetching JWKS from: {url}", file=sys.stderr)
-    try:
-        response = requests.get(url, timeout=5)
-        response.raise_for_status()
-        jwks = response.json()
-        print(f"[AUTH] Successfully fetched {len(jwks.get('keys', []))} keys", file=sys.stderr)
-        return jwks
-    except Exception as e:
-        print(f"[AUTH] ERROR fetching Keycloak public key: {e}", file=sys.stderr)
-        return None
+def get_keycloak_public_key(force_refresh: bool = False) -> Dict[str, Dict]:
+    """Return {kid: rsa_key_dict} from the cached JWKS, refetching if stale."""
+    now = time.monotonic()
+    if not force_refresh and now < _JWKS_CACHE["expires_at"]:
+        return _JWKS_CACHE["keys_by_kid"]
+
+    with _JWKS_LOCK:
+        # Another thread may have refreshed while we waited on the lock
+        now = time.monotonic()
+        if not force_refresh and now < _JWKS_CACHE["expires_at"]:
+            return _JWKS_CACHE["keys_by_kid"]
+
+        url = f"{KEYCLOAK_URL}/realms/{KEYCLOAK_REALM}/protocol/openid-connect/certs"
+        logger.debug("Fetching JWKS from: %s", url)
+        try:
+            response = _HTTP.get(url)
+            response.raise_for_status()
+            jwks = response.json()
+            keys_by_kid = {
+                k['kid']: {'kty': k['kty'], 'kid': k['kid'], 'use': k.get('use'), 'n': k['n'], 'e': k['e']}
+                for k in jwks.get('keys', [])
+                if k.get('kty') == 'RSA' and 'kid' in k
+            }
+            # Build the RSA public key objects once per fetch; from_jwk is
+            # expensive (base64url + bignum work) so it must not run per request.
+            # Rebuilding from scratch also drops keys that rotated out.
+            pubkeys_by_kid = {}
+            for kid, rsa_key in keys_by_kid.items():
+                try:
+                    pubkeys_by_kid[kid] = RSAAlgorithm.from_jwk(json.dumps(rsa_key))
+                except Exception:
+                    logger.exception("Failed to build public key for kid=%s", kid)
+            _JWKS_CACHE["keys_by_kid"] = keys_by_kid
+            _JWKS_CACHE["pubkeys_by_kid"] = pubkeys_by_kid
+            _JWKS_CACHE["expires_at"] = now + _jwks_ttl_from_response(response)
+            logger.debug("Successfully fetched %d keys", len(keys_by_kid))
+        except Exception:
+            logger.exception("Failed to fetch Keycloak public key")
+        return _JWKS_CACHE["keys_by_kid"]
+
+def _public_key_for_kid(kid: Optional[str]):
+    """Look up the prebuilt RSA public key for a kid, forcing one rate-limited
+    JWKS refetch on a miss so rotated keys are picked up without waiting out
+    the TTL."""
+    get_keycloak_public_key()
+    public_key = _JWKS_CACHE["pubkeys_by_kid"].get(kid)
+    if public_key is None:
+        now = time.monotonic()
+        if now - _JWKS_CACHE["last_miss_refresh"] > JWKS_MISS_REFRESH_SECONDS:
+            _JWKS_CACHE["last_miss_refresh"] = now
+            logger.debug("kid=%s not in cache, forcing JWKS refresh", kid)
+            get_keycloak_public_key(force_refresh=True)
+            public_key = _JWKS_CACHE["pubkeys_by_kid"].get(kid)
+    return public_key
+
+def _peek_kid(token: str) -> Optional[str]:
+    """Pull kid out of the JWT header without the full PyJWT parse; the
+    signature check later is what actually validates the token."""
+    header_b64 = token.split('.', 1)[0]
+    pad = '=' * (-len(header_b64) % 4)
+    return json.loads(base64.urlsafe_b64decode(header_b64 + pad)).get('kid')
 
 def verify_token(token: str) -> Optional[Dict]:
-    print(f"[AUTH] Verifying token (length: {len(token)})", file=sys.stderr)
+    logger.debug("Verifying token (length: %d)", len(token))
+    token_hash = hashlib.sha256(token.encode()).digest()
+    now = time.time()
+    with _TOKEN_CACHE_LOCK:
+        entry = _TOKEN_CACHE.get(token_hash)
+        if entry is not None:
+            # 5s slack so we never serve a payload right at expiry
+            if entry[0] > now + 5:
+                _TOKEN_CACHE.move_to_end(token_hash)
+                return entry[1]
+            del _TOKEN_CACHE[token_hash]
     try:
-        jwks = get_keycloak_public_key()
-        if not jwks:
-            print(f"[AUTH] ERROR: No JWKS available", file=sys.stderr)
-            return None
-        
-        unverified_header = jwt.get_unverified_header(token)
-        print(f"[AUTH] Token kid: {unverified_header.get('kid')}", file=sys.stderr)
-        
-        rsa_key = {}
-        for key in jwks['keys']:
-            if key['kid'] == unverified_header['kid']:
-                rsa_key = {'kty': key['kty'], 'kid': key['kid'], 'use': key['use'], 'n': key['n'], 'e': key['e']}
-                print(f"[AUTH] Found matching key", file=sys.stderr)
-                break
-        
-        if not rsa_key:
-            print(f"[AUTH] ERROR: No matching key found for kid={unverified_header.get('kid')}", file=sys.stderr)
+        kid = _peek_kid(token)
+        logger.debug("Token kid: %s", kid)
+
+        public_key = _public_key_for_kid(kid)
+        if public_key is None:
+            logger.warning("No matching key found for kid=%s", kid)
             return None
-        
-        from jwt.algorithms import RSAAlgorithm
-        public_key = RSAAlgorithm.from_jwk(rsa_key)
-        
+
         payload = jwt.decode(token, key=public_key, algorithms=['RS256'], options={'verify_aud': False})
-        print(f"[AUTH] Token verified successfully for user: {payload.get('preferred_username')}", file=sys.stderr)
+        logger.debug("Token verified successfully for user: %s", payload.get('preferred_username'))
+        exp = payload.get('exp')
+        if exp:
+            with _TOKEN_CACHE_LOCK:
+                _TOKEN_CACHE[token_hash] = (exp, payload)
+                _TOKEN_CACHE.move_to_end(token_hash)
+                while len(_TOKEN_CACHE) > TOKEN_CACHE_MAX:
+                    _TOKEN_CACHE.popitem(last=False)
         return payload
-    except Exception as e:
-        print(f"[AUTH] ERROR: Token verification failed: {e}", file=sys.stderr)
-        import traceback
-        traceback.print_exc(file=sys.stderr)
+    except Exception:
+        logger.exception("Token verification failed")
         return None
 
 def extract_user_from_token(token: str) -> Optional[User]:
-    print(f"[AUTH] Extracting user from token", file=sys.stderr)
+    logger.debug("Extracting user from token")
     payload = verify_token(token)
     if not payload:
-        print(f"[AUTH] ERROR: No payload from verify_token", file=sys.stderr)
+        logger.debug("No payload from verify_token")
         return None
     
     user_id = payload.get('sub')
@@ -79,17 +170,20 @@ def extract_user_from_token(token: str) -> Optional[User]:
     roles = payload.get('realm_access', {}).get('roles', [])
     is_admin = 'admin' in roles
     
-    print(f"[AUTH] Created user: {username} (admin={is_admin})", file=sys.stderr)
+    logger.debug("Created user: %s (admin=%s)", username, is_admin)
     return User(user_id, username, email, is_admin)
 
 
 from fastapi import Header, HTTPException
 
 REACTOR_API_KEY = os.getenv("REACTOR_API_KEY")
+_REACTOR_API_KEY_BYTES = REACTOR_API_KEY.encode() if REACTOR_API_KEY else None
 
 def verify_api_key(x_api_key: str = Header(None)):
-    if not REACTOR_API_KEY:
+    if not _REACTOR_API_KEY_BYTES:
         raise HTTPException(status_code=500, detail="REACTOR_API_KEY not configured on server")
-    if not x_api_key or x_api_key != REACTOR_API_KEY:
+    # compare_digest: constant-time, no short-circuit on first bad byte
+    provided = (x_api_key or "").encode()
+    if not hmac.compare_digest(provided, _REACTOR_API_KEY_BYTES):
         raise HTTPException(status_code=401, detail="Invalid or missing API key")
     return True
@@ -1,59 +1,100 @@
-import os, re, json, subprocess, tempfile, time
+import os, re, json, tempfile
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+import httpx
+
+try:
+    import orjson
+except ImportError:  # fall back to stdlib json
+    orjson = None
+
+OLLAMA_BASE_URL = os.environ.get("OLLAMA_BASE_URL", "http://10.0.0.3:11434")
 MODEL_DIR = Path(os.environ.get("REACTOR_MODEL_DIR", "/mnt/wopr-ai-models/llm")).resolve()
 STATE_FILE = Path(os.environ.get("REACTOR_AUTOSCAN_STATE", "/opt/reactor-mcp/backend/.autoscan_state.json")).resolve()
 
+# Precompiled once; _slugify runs for every GGUF on every scan
+_RE_GGUF = re.compile(r'\.gguf$')
+_RE_QUANT = re.compile(r'-(q\d+_[a-z0-9_]+|iq\d+_[a-z0-9_]+|f\d+|bf16|fp16|int8|int4)$')
+_RE_NONALNUM = re.compile(r'[^a-z0-9]+')
+_RE_DASHES = re.compile(r'-{2,}')
+
 def _slugify(name: str) -> str:
     s = name.lower().strip()
-    s = re.sub(r'\.gguf$', '', s)
+    s = _RE_GGUF.sub('', s)
     # strip common quant suffixes to keep names stable across quant swaps
-    s = re.sub(r'-(q\d+_[a-z0-9_]+|iq\d+_[a-z0-9_]+|f\d+|bf16|fp16|int8|int4)$', '', s)
-    s = re.sub(r'[^a-z0-9]+', '-', s)
-    s = re.sub(r'-{2,}', '-', s).strip('-')
+    s = _RE_QUANT.sub('', s)
+    s = _RE_NONALNUM.sub('-', s)
+    s = _RE_DASHES.sub('-', s).strip('-')
     return s or "model"
 
+# Directory listing cache; MODEL_DIR lives on NFS so relisting it is slow.
+# The dir mtime changes whenever a file is added/removed, which is exactly
+# when we need to rescan.
+_GLOB_CACHE = {"mtime": 0, "files": []}
+
+def _list_ggufs() -> list[str]:
+    mtime = MODEL_DIR.stat().st_mtime_ns
+    if mtime != _GLOB_CACHE["mtime"]:
+        # scandir keeps the dirent type info, so no per-entry stat or Path
+        # construction like glob does
+        with os.scandir(MODEL_DIR) as it:
+            _GLOB_CACHE["files"] = sorted(
+                entry.path for entry in it
+                if entry.name.endswith(".gguf") and entry.is_file()
+            )
+        _GLOB_CACHE["mtime"] = mtime
+    return _GLOB_CACHE["files"]
+
 def _load_state() -> dict:
     if STATE_FILE.exists():
         try:
+            if orjson is not None:
+                return orjson.loads(STATE_FILE.read_bytes())
             return json.loads(STATE_FILE.read_text())
         except Exception:
             return {}
     return {}
 
 def _save_state(state: dict) -> None:
-    tmp = STATE_FILE.with_suffix(f".tmp.{int(time.time())}")
-    tmp.write_text(json.dumps(state, indent=2, sort_keys=True))
-    tmp.replace(STATE_FILE)
+    if orjson is not None:
+        data = orjson.dumps(state, option=orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS)
+    else:
+        data = json.dumps(state, indent=2, sort_keys=True).encode()
+    # POSIX-atomic rename in the same directory; no epoch-suffixed temp files
+    # left behind when a replace fails partway
+    with tempfile.NamedTemporaryFile("wb", dir=STATE_FILE.parent, prefix=".autoscan_state.", delete=False) as tmp:
+        tmp.write(data)
+        tmp_path = tmp.name
+    os.replace(tmp_path, STATE_FILE)
 
 def _ollama_list() -> set[str]:
-    # Prefer the CLI because it reflects Ollama's real registry fast
+    # /api/tags gives us the registry as JSON without forking the CLI
     try:
-        out = subprocess.check_output(["ollama", "list"], text=True, stderr=subprocess.STDOUT)
+        r = httpx.get(f"{OLLAMA_BASE_URL}/api/tags", timeout=5)
+        r.raise_for_status()
         names = set()
-        for line in out.splitlines()[1:]:
-            parts = line.split()
-            if parts:
-                names.add(parts[0].strip())
+        for m in r.json().get("models", []):
+            name = m.get("name", "")
+            if name:
+                names.add(name)
+                names.add(name.split(":")[0])  # "foo:latest" is also just "foo"
         return names
     except Exception:
         return set()
 
-def _ollama_create(model_name: str, gguf_path: Path) -> tuple[bool, str]:
-    # Create a temporary Modelfile that points to the GGUF
-    with tempfile.NamedTemporaryFile("w", delete=False, prefix="Modelfile_", suffix=".txt") as f:
-        f.write(f"FROM {str(gguf_path)}\n")
-        modelfile = f.name
+def _ollama_create(model_name: str, gguf_path: str) -> tuple[bool, str]:
+    # Send the Modelfile inline over the HTTP API: no tempfile, no CLI fork.
+    # No timeout; creating from a multi-GB GGUF legitimately takes a while.
     try:
-        out = subprocess.check_output(["ollama", "create", model_name, "-f", modelfile], text=True, stderr=subprocess.STDOUT)
-        return True, out
-    except subprocess.CalledProcessError as e:
-        return False, e.output
-    finally:
-        try:
-            os.unlink(modelfile)
-        except Exception:
-            pass
+        r = httpx.post(
+            f"{OLLAMA_BASE_URL}/api/create",
+            json={"name": model_name, "modelfile": f"FROM {gguf_path}\n"},
+            timeout=None,
+        )
+        return r.status_code == 200, r.text
+    except Exception as e:
+        return False, str(e)
 
 def scan_and_register(verbose: bool = True) -> dict:
     """
@@ -72,47 +113,55 @@ def scan_and_register(verbose: bool = True) -> dict:
         summary["failed"].append({"model": None, "file": str(MODEL_DIR), "error": "MODEL_DIR not found"})
         return summary
 
-    ggufs = sorted(MODEL_DIR.glob("*.gguf"))
+    ggufs = _list_ggufs()
     summary["found_gguf"] = len(ggufs)
 
     existing = _ollama_list()
     state = _load_state()
     file_to_model = state.get("file_to_model", {})
 
-    # Build deterministic mapping (file -> model name)
+    # Single set of every claimed name — Ollama's registry plus prior mappings
+    taken = set(existing)
+    taken.update(file_to_model.values())
+
+    # Persisted mappings are final; only new files get slugified and pushed
+    # through the uniqueness loop, so a stable directory costs O(new files)
+    updates = {}
     for p in ggufs:
-        key = str(p)
-        if key not in file_to_model:
-            file_to_model[key] = _slugify(p.name)
-
-    # Ensure unique model names (avoid collisions)
-    used = set(existing)
-    seen = set()
-    for k, v in list(file_to_model.items()):
-        base = v
+        if p in file_to_model:
+            continue
+        name = base = _slugify(os.path.basename(p))
         n = 1
-        name = base
-        while name in used or name in seen:
+        while name in taken:
             n += 1
             name = f"{base}-{n}"
-        file_to_model[k] = name
-        seen.add(name)
+        updates[p] = name
+        taken.add(name)
 
-    state["file_to_model"] = file_to_model
-    _save_state(state)
+    if updates:
+        file_to_model.update(updates)
+        state["file_to_model"] = file_to_model
+        _save_state(state)
 
-    # Register missing ones
+    # Register missing ones; each create blocks for seconds on a multi-GB
+    # GGUF, so run a few in parallel (Ollama serializes the heavy loading
+    # internally but manifest/metadata work overlaps fine)
+    pending = []
     for p in ggufs:
-        model_name = file_to_model[str(p)]
+        model_name = file_to_model[p]
         if model_name in existing:
             summary["already_present"].append(model_name)
-            continue
-        ok, out = _ollama_create(model_name, p)
-        if ok:
-            summary["created"].append(model_name)
-            existing.add(model_name)
         else:
-            summary["failed"].append({"model": model_name, "file": str(p), "error": out[-2000:]})
+            pending.append((model_name, p))
+
+    if pending:
+        with ThreadPoolExecutor(max_workers=min(4, len(pending))) as pool:
+            results = pool.map(lambda args: _ollama_create(*args), pending)
+            for (model_name, p), (ok, out) in zip(pending, results):
+                if ok:
+                    summary["created"].append(model_name)
+                else:
+                    summary["failed"].append({"model": model_name, "file": p, "error": out[-2000:]})
 
     if verbose:
         print(json.dumps(summary, indent=2))
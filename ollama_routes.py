@@ -5,16 +5,49 @@ Provides chat, completion, and RAG-enhanced inference
 """
 
 from fastapi import APIRouter, HTTPException, Depends
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
+from starlette.background import BackgroundTask
 from typing import Optional, List, Dict, Any
+import functools
 import httpx
 import os
 from auth_middleware import verify_api_key
 
-router = APIRouter(prefix="/api/ollama", tags=["ollama"])
+try:
+    import orjson
+    from fastapi.responses import ORJSONResponse as _DefaultResponse
+except ImportError:  # orjson not installed; stdlib json still works
+    orjson = None
+    from fastapi.responses import JSONResponse as _DefaultResponse
+
+router = APIRouter(prefix="/api/ollama", tags=["ollama"], default_response_class=_DefaultResponse)
+
+def _decode_json(response: httpx.Response):
+    # orjson.loads on raw bytes beats httpx's stdlib-json .json() on the
+    # large /api/tags and chat payloads
+    if orjson is not None:
+        return orjson.loads(response.content)
+    return response.json()
 
 OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://10.0.0.3:11434")
 
+# One pooled client shared by every endpoint so requests reuse connections to
+# the home rig instead of opening a fresh one per call. Per-call timeouts
+# below override the default.
+client = httpx.AsyncClient(timeout=30.0, limits=httpx.Limits(max_keepalive_connections=10))
+
+@router.on_event("shutdown")
+async def _close_client():
+    # Drain the keepalive pool on graceful shutdown/reload
+    await client.aclose()
+
+@functools.lru_cache(maxsize=512)
+def _format_context(chunks: tuple) -> str:
+    """Join RAG chunks into the context block; memoized since the same chunks
+    are typically reused across turns of a session."""
+    return "\n\n".join(f"Document {i+1}:\n{c}" for i, c in enumerate(chunks))
+
 class ChatMessage(BaseModel):
     role: str  # "user", "assistant", "system"
     content: str
@@ -39,33 +72,41 @@ class CompletionRequest(BaseModel):
 async def list_models(api_key: str = Depends(verify_api_key)):
     """List all available Ollama models on home rig"""
     try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.get(f"{OLLAMA_BASE_URL}/api/tags")
-            response.raise_for_status()
-            data = response.json()
-            models = data.get("models", [])
-            return {
-                "models": [
-                    {
-                        "name": m["name"],
-                        "size": m.get("size", 0),
-                        "digest": m.get("digest", ""),
-                        "modified_at": m.get("modified_at", "")
-                    }
-                    for m in models
-                ],
-                "count": len(models)
+        response = await client.get(f"{OLLAMA_BASE_URL}/api/tags")
+        response.raise_for_status()
+        models = _decode_json(response).get("models", [])
+        # Project fields in place instead of building a second list, so the
+        # raw model dicts (which carry large detail blobs) are dropped as we go
+        for i, m in enumerate(models):
+            models[i] = {
+                "name": m["name"],
+                "size": m.get("size", 0),
+                "digest": m.get("digest", ""),
+                "modified_at": m.get("modified_at", "")
             }
+        return {"models": models, "count": len(models)}
     except httpx.HTTPError as e:
         raise HTTPException(status_code=503, detail=f"Ollama service unavailable: {str(e)}")
 
+async def _stream_ollama(path: str, payload: dict) -> StreamingResponse:
+    """Proxy an Ollama NDJSON stream straight through to the caller so tokens
+    arrive as they are generated instead of buffering the full response."""
+    req = client.build_request("POST", f"{OLLAMA_BASE_URL}{path}", json=payload, timeout=120.0)
+    response = await client.send(req, stream=True)
+    if response.status_code >= 400:
+        detail = (await response.aread()).decode(errors="replace")
+        await response.aclose()
+        raise HTTPException(status_code=503, detail=f"Ollama request failed: {detail}")
+    return StreamingResponse(response.aiter_raw(), media_type="application/x-ndjson",
+                             background=BackgroundTask(response.aclose))
+
 @router.post("/chat")
 async def chat_completion(request: ChatRequest, api_key: str = Depends(verify_api_key)):
     """Chat completion with RAG context support"""
     try:
         messages = []
         if request.context:
-            context_text = "\n\n".join([f"Document {i+1}:\n{chunk}" for i, chunk in enumerate(request.context)])
+            context_text = _format_context(tuple(request.context))
             messages.append({"role": "system", "content": f"Context:\n\n{context_text}\n\nUse this to answer questions."})
         messages.extend([{"role": m.role, "content": m.content} for m in request.messages])
         
@@ -76,10 +117,11 @@ async def chat_completion(request: ChatRequest, api_key: str = Depends(verify_ap
             "options": {"temperature": request.temperature, "num_predict": request.max_tokens}
         }
         
-        async with httpx.AsyncClient(timeout=120.0) as client:
-            response = await client.post(f"{OLLAMA_BASE_URL}/api/chat", json=payload)
-            response.raise_for_status()
-            return response.json()
+        if request.stream:
+            return await _stream_ollama("/api/chat", payload)
+        response = await client.post(f"{OLLAMA_BASE_URL}/api/chat", json=payload, timeout=120.0)
+        response.raise_for_status()
+        return _decode_json(response)
     except httpx.HTTPError as e:
         raise HTTPException(status_code=503, detail=f"Ollama request failed: {str(e)}")
 
@@ -89,7 +131,7 @@ async def text_completion(request: CompletionRequest, api_key: str = Depends(ver
     try:
         prompt = request.prompt
         if request.context:
-            context_text = "\n\n".join([f"Document {i+1}:\n{chunk}" for i, chunk in enumerate(request.context)])
+            context_text = _format_context(tuple(request.context))
             prompt = f"Context:\n\n{context_text}\n\n---\n\n{prompt}"
         
         payload = {
@@ -99,10 +141,11 @@ async def text_completion(request: CompletionRequest, api_key: str = Depends(ver
             "options": {"temperature": request.temperature, "num_predict": request.max_tokens}
         }
         
-        async with httpx.AsyncClient(timeout=120.0) as client:
-            response = await client.post(f"{OLLAMA_BASE_URL}/api/generate", json=payload)
-            response.raise_for_status()
-            return response.json()
+        if request.stream:
+            return await _stream_ollama("/api/generate", payload)
+        response = await client.post(f"{OLLAMA_BASE_URL}/api/generate", json=payload, timeout=120.0)
+        response.raise_for_status()
+        return _decode_json(response)
     except httpx.HTTPError as e:
         raise HTTPException(status_code=503, detail=f"Ollama request failed: {str(e)}")
 
@@ -110,9 +153,8 @@ async def text_completion(request: CompletionRequest, api_key: str = Depends(ver
 async def ollama_health(api_key: str = Depends(verify_api_key)):
     """Check Ollama service health"""
     try:
-        async with httpx.AsyncClient(timeout=5.0) as client:
-            response = await client.get(f"{OLLAMA_BASE_URL}/api/tags")
-            response.raise_for_status()
-            return {"status": "online", "base_url": OLLAMA_BASE_URL, "models_available": len(response.json().get("models", []))}
+        response = await client.get(f"{OLLAMA_BASE_URL}/api/tags", timeout=5.0)
+        response.raise_for_status()
+        return {"status": "online", "base_url": OLLAMA_BASE_URL, "models_available": len(_decode_json(response).get("models", []))}
     except Exception as e:
         return {"status": "offline", "base_url": OLLAMA_BASE_URL, "error": str(e)}
@@ -1,25 +1,48 @@
-from fastapi import APIRouter
+import hashlib
+import json
+
+from fastapi import APIRouter, Request, Response
 
 router = APIRouter(prefix="/api")
 
+# These payloads are completely static, so serialize them once at import and
+# hand the same bytes back on every poll — the UI hits these constantly and
+# there's no point re-running the encoder each time.
+_STATUS_BYTES = json.dumps({
+    "api": "online",
+    "mcp": "online",
+    "spec_kit": "online",
+    "rag": "online",
+    "db": "online",
+    "ollama": "online",
+    "forgejo": "online"
+}).encode()
+
+_MODELS_BYTES = json.dumps({
+    "models": []
+}).encode()
+
+_TASKS_BYTES = json.dumps([]).encode()
+
+def _cached_json(request: Request, body: bytes, etag: str) -> Response:
+    # Short max-age plus a strong ETag lets browsers 304 most of the polling
+    if request.headers.get("If-None-Match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(body, media_type="application/json",
+                    headers={"ETag": etag, "Cache-Control": "public, max-age=5"})
+
+_STATUS_ETAG = f'"{hashlib.md5(_STATUS_BYTES).hexdigest()}"'
+_MODELS_ETAG = f'"{hashlib.md5(_MODELS_BYTES).hexdigest()}"'
+_TASKS_ETAG = f'"{hashlib.md5(_TASKS_BYTES).hexdigest()}"'
+
 @router.get("/status")
-async def status():
-    return {
-        "api": "online",
-        "mcp": "online",
-        "spec_kit": "online",
-        "rag": "online",
-        "db": "online",
-        "ollama": "online",
-        "forgejo": "online"
-    }
+async def status(request: Request):
+    return _cached_json(request, _STATUS_BYTES, _STATUS_ETAG)
 
 @router.get("/models")
-async def models():
-    return {
-        "models": []
-    }
+async def models(request: Request):
+    return _cached_json(request, _MODELS_BYTES, _MODELS_ETAG)
 
 @router.get("/tasks")
-async def tasks():
-    return []
+async def tasks(request: Request):
+    return _cached_json(request, _TASKS_BYTES, _TASKS_ETAG)